@@ -1,36 +1,38 @@
 # cirse_streamlit/cirse_agent.py
 """
 Core helper for logging into CIRSE Library, searching videos, downloading audio,
-transcribing with Whisper, and summarising with GPT‑4o‑mini.
+transcribing with Whisper (local faster‑whisper if installed, else the API), and summarising with GPT‑4o‑mini.
 
 Designed to be imported by cirse_app.py or run via CLI (`python cirse_agent.py --query ...`).
 
 Key features:
-* Auto‑installs its own dependencies the first time they’re missing.
+* Dependencies come from requirements.txt; a missing one fails with the pip command to run.
 * Uses Playwright (headless) to handle login and scraping.
 * Keeps code readable for future tweaks.
 """
 
-import importlib, subprocess, sys, os, re, asyncio
+import importlib, os, re, asyncio, functools, hashlib, json, shutil, tempfile, textwrap, threading
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List, Optional
+from typing import AsyncIterator, Callable, List, Optional, Tuple
 
 # ---------------------------------------------------------------------------
-# Lazy dep loader so non-coders don't need pip on the command line
+# Dep loader: installs happen at build time (requirements.txt), never on import
 # ---------------------------------------------------------------------------
-def _ensure(pkg: str):
+@functools.lru_cache(maxsize=None)
+def _ensure(pkg: str, pip_name: Optional[str] = None):
     try:
         return importlib.import_module(pkg)
-    except ModuleNotFoundError:
-        subprocess.check_call([sys.executable, '-m', 'pip', 'install', pkg])
-        return importlib.import_module(pkg)
+    except ModuleNotFoundError as e:
+        raise ModuleNotFoundError(f'{pkg} is missing; run `pip install -r requirements.txt` '
+                                  f'(or `pip install {pip_name or pkg}`)', name=e.name) from e
 
-dotenv     = _ensure('python_dotenv') if _ensure('importlib').util.find_spec('python_dotenv') else _ensure('dotenv')
+dotenv     = _ensure('dotenv', 'python-dotenv')
 openai     = _ensure('openai')
 rich       = _ensure('rich')
 yt_dlp     = _ensure('yt_dlp')
-playwright = _ensure('playwright.async_api')
+playwright = _ensure('playwright.async_api', 'playwright')
+aiofiles   = _ensure('aiofiles')
 
 from rich.progress import Progress
 
@@ -47,69 +49,467 @@ class VideoResult:
     year: Optional[str] = None
     speaker: Optional[str] = None
 
+class SessionExpired(RuntimeError):
+    """A page bounced to the myCIRSE login form; the stored session is stale."""
+
+class BatchIncomplete(RuntimeError):
+    """Some Batch API requests failed; notes for the others were written.
+
+    Raised from process_videos, `outputs` lists the (notes_path,
+    transcript_path) pairs that were finished.
+    """
+    outputs: List[Tuple[Path, Path]] = []
+
 # ---------------------------------------------------------------------------
 # Playwright helpers
 # ---------------------------------------------------------------------------
-async def playwright_login(page):
-    """Log into myCIRSE using credentials from env vars."""
-    await page.goto('https://my.cirse.org')
-    await page.fill('input[name="email"]', CIRSE_EMAIL)
-    await page.fill('input[type="password"]', CIRSE_PASSWORD)
+LOGIN_URL = 'https://my.cirse.org'
+
+def _check_session(page):
+    if page.url.startswith(LOGIN_URL):
+        raise SessionExpired(page.url)
+
+async def playwright_login(page, email: Optional[str] = None, password: Optional[str] = None):
+    """Log into myCIRSE; credentials default to the env vars."""
+    await page.goto(LOGIN_URL)
+    await page.fill('input[name="email"]', email or CIRSE_EMAIL)
+    await page.fill('input[type="password"]', password or CIRSE_PASSWORD)
     await page.click('button[type="submit"]')
-    await page.wait_for_load_state('networkidle')
+    # networkidle rarely settles (analytics pings); wait for the post-login DOM instead
+    await page.wait_for_selector('a[href*="logout"], .dashboard', state='attached', timeout=10000)
+
+_HEAVY_RESOURCES = ('image', 'font', 'media', 'stylesheet')
+
+async def _skip_heavy(route):
+    if route.request.resource_type in _HEAVY_RESOURCES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def lean_context(browser, **kwargs):
+    """New context for scraping only: small viewport, no images/fonts/media/CSS."""
+    ctx = await browser.new_context(viewport={'width': 800, 'height': 600}, **kwargs)
+    await ctx.route('**/*', _skip_heavy)
+    ctx.set_default_navigation_timeout(15000)
+    return ctx
+
+def write_private(path: Path, text: str):
+    """Write `text` to a file that is 0600 from creation on; for session secrets."""
+    fd = os.open(path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600)
+    with open(fd, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+async def export_cookies(ctx, path: Path) -> Path:
+    """Write the logged-in context's cookies as a Netscape cookies.txt for yt-dlp.
+
+    Give each login its own `path` and hand it to the downloads for that login.
+    """
+    lines = ['# Netscape HTTP Cookie File']
+    for c in await ctx.cookies():
+        lines.append('\t'.join([
+            c['domain'], 'TRUE' if c['domain'].startswith('.') else 'FALSE', c['path'],
+            'TRUE' if c['secure'] else 'FALSE', str(max(int(c['expires']), 0)), c['name'], c['value'],
+        ]))
+    write_private(path, '\n'.join(lines) + '\n')
+    return path
+
+# Pull every card in one evaluate() round-trip instead of four IPC hops per card
+_SCRAPE_RESULTS_JS = """(n) => Array.from(document.querySelectorAll('.search-result')).slice(0, n).map(c => ({
+    title:   c.querySelector('.result-title')?.textContent.trim() ?? '',
+    url:     c.querySelector('a')?.href ?? '',
+    year:    c.querySelector('.result-year')?.textContent.trim() || null,
+    speaker: c.querySelector('.result-speaker')?.textContent.trim() || null,
+}))"""
 
 async def search_videos(page, query: str, max_results: int = 10) -> List[VideoResult]:
     search_url = f'https://library.cirse.org/search?q={query}'
     await page.goto(search_url)
-    await page.wait_for_selector('.search-result')
-    cards = await page.query_selector_all('.search-result')[:max_results]
-    results = []
-    for card in cards:
-        title = await card.query_selector_eval('.result-title', 'el => el.textContent.trim()')
-        url   = await card.query_selector_eval('a', 'el => el.href')
-        year = await card.query_selector_eval('.result-year', 'el => el.textContent.trim()', force_expr=True) or None
-        speaker = await card.query_selector_eval('.result-speaker', 'el => el.textContent.trim()', force_expr=True) or None
-        results.append(VideoResult(title=title, url=url, year=year, speaker=speaker))
-    return results
-
-async def _download_audio(url: str, dest: Path):
+    _check_session(page)
+    await page.wait_for_selector('.search-result', state='attached', timeout=10000)
+    raw = await page.evaluate(_SCRAPE_RESULTS_JS, max_results)
+    return [VideoResult(**r) for r in raw]
+
+# MSE/HLS.js players expose a blob: src that only exists inside the page; skip
+# blob:/data: sources and fall back to the page URL, which yt-dlp can handle.
+_MEDIA_SRC_JS = """() => ['video source[src], video[src]',
+                         'iframe[src*="player"], iframe[src*="vimeo"], iframe[src*="youtube"]']
+    .flatMap(sel => Array.from(document.querySelectorAll(sel), el => el.src))
+    .find(src => src && !/^(blob|data):/.test(src)) ?? null"""
+
+async def resolve_media_url(page, url: str) -> str:
+    """Open a lecture page and return its player's stream URL (or the page URL)."""
+    await page.goto(url)
+    _check_session(page)
+    return await page.evaluate(_MEDIA_SRC_JS) or url
+
+def _ydl_download(url: str, ydl_opts: dict) -> Path:
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(url, download=True)
+        return Path(info['requested_downloads'][0]['filepath'])
+
+async def _download_audio(url: str, dest: Path, cookiefile: Optional[Path] = None):
+    # Whisper resamples to 16 kHz mono anyway; transcoding to low-bitrate Opus
+    # here shrinks the upload by an order of magnitude at no cost in accuracy.
     ydl_opts = {
         'format': 'bestaudio/best',
-        'outtmpl': str(dest),
+        'outtmpl': str(dest.parent / f'{dest.stem}.src.%(ext)s'),
         'quiet': True,
         'nocheckcertificate': True,
+        'concurrent_fragment_downloads': 8,
     }
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        ydl.download([url])
+    if cookiefile:   # reuse the browser session instead of yt-dlp re-authenticating
+        ydl_opts['cookiefile'] = str(cookiefile)
+    if shutil.which('aria2c'):   # multi-connection fetch; yt-dlp's native downloader otherwise
+        ydl_opts['external_downloader'] = 'aria2c'
+        ydl_opts['external_downloader_args'] = ['-x', '16', '-s', '16', '-k', '1M']
+    # YoutubeDL is blocking; keep it off the event loop so other downloads progress
+    src = await asyncio.to_thread(_ydl_download, url, ydl_opts)
+    # Our own ffmpeg pass rather than FFmpegExtractAudio: that one stream-copies
+    # sources that are already Opus (most YouTube/Vimeo bestaudio), leaving
+    # them 48 kHz stereo. Written under a .part name so an interrupted encode
+    # is never mistaken for a cached file.
+    part = dest.parent / f'{dest.stem}.part{dest.suffix}'
+    proc = await asyncio.create_subprocess_exec(
+        'ffmpeg', '-v', 'error', '-y', '-i', str(src), '-vn', '-ac', '1', '-ar', '16000',
+        '-c:a', 'libopus', '-b:a', '32k', str(part), stderr=asyncio.subprocess.PIPE)
+    _, err = await proc.communicate()
+    src.unlink(missing_ok=True)
+    if proc.returncode:
+        part.unlink(missing_ok=True)
+        raise RuntimeError(f'ffmpeg failed on {url}: {err.decode(errors="replace")[-2000:]}')
+    part.replace(dest)
+
+# ---------------------------------------------------------------------------
+# Transcription: local CTranslate2 faster-whisper (int8) when installed,
+# otherwise the OpenAI Whisper API. faster-whisper is optional and never
+# auto-installed.
+# ---------------------------------------------------------------------------
+try:
+    faster_whisper = importlib.import_module('faster_whisper')
+except ModuleNotFoundError:
+    faster_whisper = None
 
-async def process_video(pw, base_url: str, video: VideoResult, out_dir: Path):
-    """Download audio, transcribe and summarise."""
-    safe_name = re.sub(r'[^A-Za-z0-9]+', '_', video.title)[:50]
-    audio_path = out_dir / f'{safe_name}.mp3'
-    transcript_path = audio_path.with_suffix('.md')
-    notes_path = audio_path.with_suffix('.notes.md')
+WHISPER_MODEL = os.getenv('WHISPER_MODEL', 'large-v3-turbo')
 
-    await _download_audio(video.url, audio_path)
+@functools.lru_cache(maxsize=None)
+def _whisper_pipeline():
+    """Load the CT2 model once per process; VAD chunks are batched together."""
+    import ctranslate2
+    if ctranslate2.get_cuda_device_count() > 0:
+        model = faster_whisper.WhisperModel(WHISPER_MODEL, device='cuda', compute_type='int8_float16')
+    else:
+        model = faster_whisper.WhisperModel(WHISPER_MODEL, device='cpu', compute_type='int8')
+    return faster_whisper.BatchedInferencePipeline(model=model)
 
-    if not OPENAI_API_KEY:
+def _openai_key(api_key: Optional[str] = None) -> str:
+    """The caller's key, else OPENAI_API_KEY from the environment (CLI runs).
+
+    Public entry points resolve the key once, when they are called, so a run
+    keeps billing the key it started with.
+    """
+    key = api_key or OPENAI_API_KEY or os.getenv('OPENAI_API_KEY')
+    if not key:
         raise RuntimeError('OPENAI_API_KEY missing')
-    openai.api_key = OPENAI_API_KEY
+    return key
+
+@functools.lru_cache(maxsize=None)
+def _client_for(api_key: str):
+    return openai.AsyncOpenAI(api_key=api_key)
+
+_SAFE_NAME = re.compile(r'[^A-Za-z0-9]+')
+
+@functools.lru_cache(maxsize=None)
+def _make_dir(out_dir: Path):
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+def _paths(video: VideoResult, out_dir: Path):
+    """Audio, transcript and notes paths for a lecture.
+
+    Each name carries a short hash of what that file depends on: the audio
+    of the URL alone, the transcript also of the speech model, the notes also
+    of the summary model. A model change only redoes the stages downstream.
+    """
+    title = _SAFE_NAME.sub('_', video.title)[:50]
+    digest = lambda *parts: hashlib.sha1('|'.join(parts).encode()).hexdigest()[:8]
+    asr = WHISPER_MODEL if faster_whisper else 'whisper-1'
+    return (out_dir / f'{title}_{digest(video.url)}.opus',
+            out_dir / f'{title}_{digest(video.url, asr)}.md',
+            out_dir / f'{title}_{digest(video.url, asr, SUMMARY_MODEL)}.notes.md')
+
+def _cached(path: Path) -> bool:
+    return path.exists() and path.stat().st_size > 0
 
-    with open(audio_path, 'rb') as f:
-        transcript_text = openai.Audio.transcribe('whisper-1', f, response_format='text')
+async def download_audio(video: VideoResult, out_dir: Path, page=None,
+                         cookiefile: Optional[Path] = None) -> Path:
+    """Fetch a lecture's audio; with a logged-in `page`, the player's stream URL is used."""
+    _make_dir(out_dir)
+    audio_path, _, _ = _paths(video, out_dir)
+    if not _cached(audio_path):
+        url = await resolve_media_url(page, video.url) if page else video.url
+        await _download_audio(url, audio_path, cookiefile)
+    return audio_path
 
+async def _segments(audio_path: Path, api_key: Optional[str]) -> AsyncIterator[str]:
+    """Yield transcript segments as they are decoded."""
+    if faster_whisper is None:
+        async with aiofiles.open(audio_path, 'rb') as f:
+            data = await f.read()
+        # .opus is an Ogg container; the API only recognises it by the .ogg name
+        resp = await _client_for(api_key).audio.transcriptions.create(
+            model='whisper-1', file=(audio_path.with_suffix('.ogg').name, data), response_format='verbose_json')
+        # Older 1.x clients type this as Transcription, whose segments are plain dicts
+        for seg in resp.segments or []:
+            yield (seg['text'] if isinstance(seg, dict) else seg.text).strip()
+        return
+
+    # faster-whisper decodes lazily while its generator is consumed, so drain it
+    # in a worker thread and hand segments back to the loop as they appear.
+    # The thread itself can't be cancelled; `stop` ends it at the next segment.
+    loop, q, stop = asyncio.get_running_loop(), asyncio.Queue(), threading.Event()
+
+    def produce():
+        try:
+            segments, _ = _whisper_pipeline().transcribe(str(audio_path), batch_size=16, vad_filter=True, beam_size=5)
+            for seg in segments:
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(q.put_nowait, seg.text.strip())
+        finally:
+            loop.call_soon_threadsafe(q.put_nowait, None)
+
+    decoder = asyncio.ensure_future(asyncio.to_thread(produce))
+    try:
+        while (text := await q.get()) is not None:
+            yield text
+    finally:
+        stop.set()      # consumer cancelled or failed: don't decode the rest of the lecture
+        await decoder   # re-raises a decode error
+
+async def transcribe(audio_path: Path, transcript_path: Path,
+                     on_window: Optional[Callable[[str], None]] = None,
+                     api_key: Optional[str] = None) -> str:
+    """Transcribe one file and write the transcript to `transcript_path`.
+
+    `on_window(text)` receives each ≈CHUNK_CHARS window as soon as it is
+    decoded, so window summaries can start while the rest is still being
+    transcribed. Lectures that fit in one window emit nothing; they are
+    summarised in a single prompt.
+    """
+    if _cached(transcript_path):
+        return transcript_path.read_text(encoding='utf-8')
+    parts, window, size, emitted = [], [], 0, False
+    # faster-whisper needs no key; don't demand one
+    async for text in _segments(audio_path, api_key if faster_whisper else _openai_key(api_key)):
+        parts.append(text); window.append(text); size += len(text) + 1
+        if on_window and size >= CHUNK_CHARS:
+            on_window(' '.join(window))
+            window, size, emitted = [], 0, True
+    if on_window and emitted and window:
+        on_window(' '.join(window))
+    transcript_text = ' '.join(parts)
     transcript_path.write_text(transcript_text, encoding='utf-8')
+    return transcript_text
 
-    prompt = f"""Summarise the following CIRSE lecture titled '{video.title}'
-by {video.speaker or 'unknown speaker'} into ≤15 bullet points (concise).\n\n{transcript_text}"""
-    chat = openai.ChatCompletion.create(
-        model='gpt-4o-mini',
+# ---------------------------------------------------------------------------
+# Summarisation: map-reduce over ~3k-token windows so long lectures don't go
+# out as one giant prompt; the window summaries run concurrently.
+# ---------------------------------------------------------------------------
+SUMMARY_MODEL = 'gpt-4o-mini'
+CHUNK_CHARS   = 12000   # ≈3k tokens of English transcript
+
+async def _chat(prompt: str, api_key: str) -> str:
+    chat = await _client_for(api_key).chat.completions.create(
+        model=SUMMARY_MODEL,
         messages=[{'role': 'user', 'content': prompt}],
         temperature=0.2,
     )
-    notes = chat.choices[0].message.content.strip()
+    return chat.choices[0].message.content.strip()
+
+def _header(video: VideoResult) -> str:
+    return f"the following CIRSE lecture titled '{video.title}'\nby {video.speaker or 'unknown speaker'}"
+
+def _single_prompt(transcript_text: str, video: VideoResult) -> str:
+    return f'Summarise {_header(video)} into ≤15 bullet points (concise).\n\n{transcript_text}'
+
+async def _bullets(window: str, api_key: str) -> str:
+    return await _chat(f'Bullet summary:\n{window}', api_key)
+
+async def summarise(transcript_text: str, video: VideoResult, out_dir: Path,
+                    partials: Optional[List[str]] = None, api_key: Optional[str] = None) -> Path:
+    """Write ≤15-bullet notes; `partials` are window summaries made while transcribing."""
+    _, _, notes_path = _paths(video, out_dir)
+    if _cached(notes_path):
+        return notes_path
+    api_key = _openai_key(api_key)
+    header = _header(video)
+    if partials is None:
+        chunks = textwrap.wrap(transcript_text, CHUNK_CHARS, break_long_words=False)
+        partials = await asyncio.gather(*(_bullets(c, api_key) for c in chunks)) if len(chunks) > 1 else []
+    if not partials:
+        notes = await _chat(_single_prompt(transcript_text, video), api_key)
+    else:
+        notes = await _chat(f'These are bullet summaries of consecutive parts of {header}. '
+                            f'Merge them into ≤15 bullet points (concise).\n\n' + '\n\n'.join(partials), api_key)
     notes_path.write_text(notes, encoding='utf-8')
-    return notes_path, transcript_path
+    return notes_path
+
+async def summarise_batch(items: List[Tuple[VideoResult, str]], out_dir: Path,
+                          poll_every: float = 30, api_key: Optional[str] = None) -> List[Path]:
+    """Summarise many transcripts through the OpenAI Batch API.
+
+    Half the price of live calls, but OpenAI may take up to 24 h, so this is
+    meant for unattended runs. Each lecture goes out as a single prompt.
+    Requests that fail on their own don't sink the batch: every successful
+    row is written, then BatchIncomplete names the lectures still missing
+    notes (a rerun only resubmits those).
+    """
+    todo = [(v, t) for v, t in items if not _cached(_paths(v, out_dir)[2])]
+    if todo:
+        client = _client_for(_openai_key(api_key))
+        lines = [json.dumps({
+            'custom_id': str(i), 'method': 'POST', 'url': '/v1/chat/completions',
+            'body': {'model': SUMMARY_MODEL, 'temperature': 0.2,
+                     'messages': [{'role': 'user', 'content': _single_prompt(t, v)}]},
+        }) for i, (v, t) in enumerate(todo)]
+        f = await client.files.create(file=('batch.jsonl', '\n'.join(lines).encode()), purpose='batch')
+        batch = await client.batches.create(input_file_id=f.id, endpoint='/v1/chat/completions',
+                                            completion_window='24h')
+        while batch.status not in ('completed', 'failed', 'expired', 'cancelled'):
+            await asyncio.sleep(poll_every)
+            batch = await client.batches.retrieve(batch.id)
+        if batch.status != 'completed':
+            raise RuntimeError(f'OpenAI batch {batch.id} {batch.status}')
+        # Per-request failures carry `error` or a non-200 response, in either
+        # file; output_file_id is None when every request failed.
+        errors = {}
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in (await client.files.content(file_id)).text.splitlines():
+                row = json.loads(line)
+                response = row.get('response') or {}
+                if row.get('error') or response.get('status_code') != 200:
+                    errors[row['custom_id']] = ((row.get('error') or {}).get('message')
+                                                or f"HTTP {response.get('status_code')}")
+                    continue
+                video = todo[int(row['custom_id'])][0]
+                notes = response['body']['choices'][0]['message']['content'].strip()
+                _paths(video, out_dir)[2].write_text(notes, encoding='utf-8')
+        failed = [f"{v.title} ({errors.get(str(i), 'no result')})"
+                  for i, (v, _) in enumerate(todo) if not _cached(_paths(v, out_dir)[2])]
+        if failed:
+            raise BatchIncomplete(f'OpenAI batch {batch.id}: {len(failed)} of {len(todo)} summaries failed: '
+                                  + '; '.join(failed))
+    return [_paths(v, out_dir)[2] for v, _ in items]
+
+async def process_video(video: VideoResult, out_dir: Path, page=None,
+                        cookiefile: Optional[Path] = None, api_key: Optional[str] = None) -> Tuple[Path, Path]:
+    """One lecture through process_videos; returns (notes_path, transcript_path)."""
+    page_pool = None
+    if page is not None:
+        page_pool = asyncio.Queue()
+        page_pool.put_nowait(page)
+    (pair,) = await process_videos([video], out_dir, downloaders=1, page_pool=page_pool,
+                                   cookiefile=cookiefile, api_key=api_key)
+    return pair
+
+async def process_videos(videos: List[VideoResult], out_dir: Path,
+                         on_done: Optional[Callable[[VideoResult], None]] = None,
+                         downloaders: int = 4, batch: bool = False,
+                         page_pool: Optional[asyncio.Queue] = None,
+                         cookiefile: Optional[Path] = None,
+                         api_key: Optional[str] = None) -> List[Tuple[Path, Path]]:
+    """Run download → transcribe → summarise as overlapping stages.
+
+    Returns (notes_path, transcript_path) per lecture, in input order.
+
+    While lecture N is being summarised, N+1 is transcribing and N+2 is
+    downloading. A single transcriber owns the Whisper model (or the upload
+    slot); window summaries start while a lecture is still transcribing and
+    the final merge is fired off as soon as its transcript lands.
+    `on_done(video)` is called as each lecture finishes; lectures whose
+    transcript and notes are already on disk finish immediately. With
+    `batch`, all summaries go to OpenAI's Batch API once everything is
+    transcribed (see summarise_batch). Downloads check a logged-in page
+    out of `page_pool`, if given, to resolve stream URLs and return it after;
+    `cookiefile` (see export_cookies) carries the same login into yt-dlp.
+    Every OpenAI call made for this run bills `api_key` (default: the env var).
+    """
+    outputs = [(notes_path, transcript_path) for _, transcript_path, notes_path in (_paths(v, out_dir) for v in videos)]
+    todo = []
+    for v, (notes_path, transcript_path) in zip(videos, outputs):
+        if _cached(transcript_path) and _cached(notes_path):
+            if on_done:
+                on_done(v)
+        else:
+            todo.append(v)
+    if not todo:
+        return outputs
+    api_key = _openai_key(api_key)
+
+    picks_q = asyncio.Queue()
+    for v in todo:
+        picks_q.put_nowait(v)
+    dl_q, tx_q = asyncio.Queue(maxsize=2), asyncio.Queue(maxsize=2)
+
+    async def _download(video):
+        if page_pool is None:
+            return await download_audio(video, out_dir, cookiefile=cookiefile)
+        page = await page_pool.get()
+        try:
+            return await download_audio(video, out_dir, page, cookiefile)
+        finally:
+            page_pool.put_nowait(page)
+
+    async def dl_worker():
+        while not picks_q.empty():
+            video = picks_q.get_nowait()
+            await dl_q.put((video, await _download(video)))
+
+    async def tx_worker(tg):
+        for _ in todo:
+            video, audio_path = await dl_q.get()
+            maps = []
+            on_window = None if batch else (lambda w: maps.append(tg.create_task(_bullets(w, api_key))))
+            transcript_text = await transcribe(audio_path, _paths(video, out_dir)[1], on_window=on_window,
+                                               api_key=api_key)
+            await tx_q.put((video, transcript_text, maps))
+
+    async def _summarise_one(video, transcript_text, maps):
+        await summarise(transcript_text, video, out_dir, list(await asyncio.gather(*maps)) or None, api_key)
+        if on_done:
+            on_done(video)
+
+    async def sum_worker(tg):
+        if batch:
+            items = [(await tx_q.get())[:2] for _ in todo]
+            try:
+                await summarise_batch(items, out_dir, api_key=api_key)
+            finally:
+                if on_done:   # lectures whose notes did come back, even if others failed
+                    for video, _ in items:
+                        if _cached(_paths(video, out_dir)[2]):
+                            on_done(video)
+            return
+        for _ in todo:
+            tg.create_task(_summarise_one(*await tx_q.get()))
+
+    # Each download works on its own pooled page/context, so the stages only
+    # share the driver connection, not a page. Every task, window summaries
+    # included, belongs to the group: the first failure anywhere cancels all
+    # the rest instead of leaving them parked on a queue or still billing.
+    try:
+        async with asyncio.TaskGroup() as tg:
+            for _ in range(min(downloaders, len(todo))):
+                tg.create_task(dl_worker())
+            tg.create_task(tx_worker(tg))
+            tg.create_task(sum_worker(tg))
+    except ExceptionGroup as eg:
+        err = eg.exceptions[0]   # callers catch the stage's own error (e.g. SessionExpired)
+        if isinstance(err, BatchIncomplete):
+            err.outputs = [pair for pair in outputs if _cached(pair[0])]
+        raise err
+    return outputs
 
 # ---------------------------------------------------------------------------
 # CLI
@@ -119,18 +519,27 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--query', required=True)
     parser.add_argument('--top', type=int, default=5)
+    parser.add_argument('--batch', action='store_true', help='summarise via the OpenAI Batch API (cheaper, slow)')
     args = parser.parse_args()
 
     async def main():
-        async with playwright.async_playwright() as pw:
-            browser = await pw.chromium.launch(headless=False)
-            page = await browser.new_page()
-            await playwright_login(page)
-            hits = await search_videos(page, args.query, args.top)
-            for i, v in enumerate(hits, 1):
-                print(f'[{i}] {v.title}')
-            indices = input('Pick numbers: ').split()
-            out = Path('cirse_notes'); out.mkdir(exist_ok=True)
-            for i in indices:
-                await process_video(pw, 'https://library.cirse.org', hits[int(i)-1], out)
-    asyncio.run(main())
+        with tempfile.TemporaryDirectory() as tmp:
+            async with playwright.async_playwright() as pw:
+                browser = await pw.chromium.launch(headless=False)
+                page = await (await lean_context(browser)).new_page()
+                await playwright_login(page)
+                cookies = await export_cookies(page.context, Path(tmp) / 'cookies.txt')
+                hits = await search_videos(page, args.query, args.top)
+                for i, v in enumerate(hits, 1):
+                    print(f'[{i}] {v.title}')
+                indices = input('Pick numbers: ').split()
+                out = Path('cirse_notes'); out.mkdir(exist_ok=True)
+                await process_videos([hits[int(i)-1] for i in indices], out, batch=args.batch, cookiefile=cookies,
+                                     on_done=lambda v: print(f'done: {v.title}'))
+
+    try:
+        import uvloop    # lower per-event overhead for the Playwright driver IPC
+    except ImportError:
+        asyncio.run(main())
+    else:
+        uvloop.run(main())
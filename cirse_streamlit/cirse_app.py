@@ -1,42 +1,93 @@
-# cirse_streamlit/cirse_app.py  (v4 – forces clean Chromium install every cold boot)
+# cirse_streamlit/cirse_app.py  (v5 – installs Chromium once per Playwright version)
 
 from __future__ import annotations
-import asyncio, importlib, subprocess, sys, os
+import asyncio, atexit, concurrent.futures, dataclasses, hashlib, importlib, importlib.metadata, io, json, subprocess, sys, os, tempfile, threading, types, zipfile
 from pathlib import Path
 from typing import List
+import pandas as pd
 import streamlit as st
 
-def _ensure(pkg: str):
+try:
+    import uvloop    # libuv loop: cheaper wakeups for Playwright/OpenAI IPC
+except ImportError:
+    uvloop = None
+
+def _ensure(pkg: str, pip_name: str | None = None):
     try:
         return importlib.import_module(pkg)
-    except ModuleNotFoundError:
-        st.warning(f'Installing {pkg} …')
-        subprocess.check_call([sys.executable, '-m', 'pip', 'install', pkg])
-        return importlib.import_module(pkg)
+    except ModuleNotFoundError as e:
+        if e.name and (pkg == e.name or pkg.startswith(e.name + '.')):
+            st.error(f'{pip_name or pkg} is not installed; add it to requirements.txt and redeploy.')
+        else:   # the module is there but one of its own imports is missing
+            st.error(str(e))
+        raise
+
+# The script body re-executes on every widget interaction; one cached namespace
+# keeps the import probing to the first run of the process. Packages are
+# installed from requirements.txt at build time, never from a request.
+@st.cache_resource(show_spinner=False)
+def deps() -> types.SimpleNamespace:
+    return types.SimpleNamespace(
+        pw=_ensure('playwright.async_api', 'playwright'),
+        agent=_ensure('cirse_streamlit.cirse_agent'),
+    )
 
-# Always set PLAYWRIGHT_BROWSERS_PATH=0 so Playwright uses per‑project cache
-os.environ['PLAYWRIGHT_BROWSERS_PATH'] = '0'
+# Keep browsers in the user cache (survives reruns and app restarts) unless the
+# host already points Playwright somewhere else.
+BROWSERS_PATH = os.environ.setdefault('PLAYWRIGHT_BROWSERS_PATH', str(Path.home() / '.cache' / 'ms-playwright'))
+WORKDIR = Path('cirse_notes')   # created by the agent on first download
 
-playwright_async = _ensure('playwright.async_api')
-cirse_agent      = importlib.import_module('cirse_streamlit.cirse_agent')
+D = deps()
+playwright_async, cirse_agent = D.pw, D.agent
+
+# '0' is Playwright's "install inside site-packages"; the browsers then sit in
+# the package's driver dir, and the install marker has to sit with them.
+CACHE = (Path(playwright_async.__file__).parents[1] / 'driver' / 'package' / '.local-browsers'
+         if BROWSERS_PATH == '0' else Path(BROWSERS_PATH))
 
 # ---------------------------------------------------------------------------
-# Force‑install Chromium binaries *every* container boot, overwriting any
-# incomplete previous attempt. `--with-deps` ensures required shared libs.
+# Install Chromium binaries once per Playwright version. The marker is only
+# written after a successful install, so an interrupted attempt is retried on
+# the next boot. `--with-deps` ensures required shared libs. The version
+# lookup is cached, so a rerun costs one marker stat; the install itself is a
+# cached resource too, so sessions booting together wait on a single install.
 # ---------------------------------------------------------------------------
-def _fresh_chromium_install():
-    st.info('Ensuring headless Chromium is present (may take up to 60 s)…')
+def _playwright_cli():
+    """Command + env for Playwright's CLI, skipping the `python -m playwright` bootstrap."""
     try:
-        subprocess.run(
-            [sys.executable, '-m', 'playwright', 'install', '--with-deps', '--force', 'chromium'],
-            check=True
-        )
-    except subprocess.CalledProcessError as e:
-        st.error('Playwright failed to download Chromium. See logs.')
-        st.exception(e)
-        raise
+        from playwright._impl._driver import compute_driver_executable, get_driver_env
+    except ImportError:   # private API moved; fall back to the public entry point
+        return [sys.executable, '-m', 'playwright'], None
+    exe = compute_driver_executable()   # (node, cli.js) on current releases, a single path on older
+    return [str(p) for p in (exe if isinstance(exe, tuple) else (exe,))], get_driver_env()
+
+@st.cache_resource(show_spinner=False)
+def _chromium_marker() -> Path:
+    return CACHE / f".installed_{importlib.metadata.version('playwright')}"
 
-_fresh_chromium_install()
+# No st.info/st.spinner in here: cache_resource replays a cached function's
+# elements on every hit, which would show the banner on every rerun.
+@st.cache_resource(show_spinner=False)
+def _install_chromium(marker: Path):
+    if marker.exists():
+        return
+    cli, env = _playwright_cli()
+    # The progress bars run to megabytes; spool them to disk and only read the
+    # tail back if the install fails.
+    with tempfile.TemporaryFile() as log:
+        proc = subprocess.run([*cli, 'install', '--with-deps', 'chromium'],
+                              stdout=log, stderr=subprocess.STDOUT, env=env)
+        if proc.returncode:
+            log.seek(0)
+            st.error('Playwright failed to download Chromium.')
+            st.code(log.read().decode(errors='replace')[-4000:])
+            raise RuntimeError(f'chromium install failed (exit {proc.returncode})')
+    CACHE.mkdir(parents=True, exist_ok=True)
+    marker.write_text('ok')
+
+if not _chromium_marker().exists():
+    with st.spinner('Installing headless Chromium (first boot only, may take up to 60 s)…'):
+        _install_chromium(_chromium_marker())
 
 # ---------------------------------------------------------------------------
 # UI
@@ -51,54 +102,241 @@ with st.expander('Credentials (session only)'):
 
 query = st.text_input('Search term', placeholder='e.g. mesenteric ischemia')
 top_n = st.slider('Max results', 1, 50, 10)
+batch_mode = st.checkbox('Batch mode (cheaper, async)',
+                         help='Summaries go through the OpenAI Batch API: half price, but can take hours.')
+
+# ---------------------------------------------------------------------------
+# One event loop for the whole process, running forever in a daemon thread.
+# Playwright objects are bound to the loop that created them, so every
+# coroutine is handed to this loop rather than to a per-click asyncio.run().
+# ---------------------------------------------------------------------------
+@st.cache_resource(show_spinner=False)
+def _bg_loop():
+    loop = uvloop.new_event_loop() if uvloop else asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name='cirse-loop', daemon=True).start()
+    return loop
+
+def _submit(coro) -> concurrent.futures.Future:
+    return asyncio.run_coroutine_threadsafe(coro, _bg_loop())
+
+def _run(coro):
+    return _submit(coro).result()
+
+# One Chromium for the whole process; each request gets its own context.
+@st.cache_resource(show_spinner='Starting headless Chromium…')
+def get_browser():
+    pw      = _run(playwright_async.async_playwright().start())
+    browser = _run(pw.chromium.launch(headless=True, args=['--no-sandbox']))
+
+    def close():
+        for coro in (browser.close(), pw.stop()):
+            _submit(coro).result(timeout=10)
+
+    atexit.register(close)
+    return pw, browser
+
+# Log in once per user and keep the storage state on disk, so app restarts
+# skip the login form too. New contexts start from this state. Saved state is
+# keyed by email *and* password: a known email with the wrong password finds
+# no file and has to get through the login form.
+def _session_key(email: str, password: str) -> str:
+    return hashlib.sha256(f'{email}\0{password}'.encode()).hexdigest()[:16]
+
+def _state_path(email: str, password: str) -> Path:
+    return Path.home() / '.cache' / f'cirse_state_{_session_key(email, password)}.json'
 
-def _browser(pw):
-    return pw.chromium.launch(headless=True, args=['--no-sandbox'])
+def _cookie_path(email: str, password: str) -> Path:
+    """cookies.txt handed to yt-dlp for this login's downloads."""
+    return Path.home() / '.cache' / f'cirse_cookies_{_session_key(email, password)}.txt'
+
+# Logins and page pools are kept per user in one process-wide store, so an
+# expired session is evicted (and its contexts closed) without logging out
+# everyone else.
+@st.cache_resource(show_spinner=False)
+def _sessions() -> types.SimpleNamespace:
+    return types.SimpleNamespace(lock=threading.Lock(), users={})
+
+def _user(email: str, password: str) -> types.SimpleNamespace:
+    store = _sessions()
+    with store.lock:
+        return store.users.setdefault(_session_key(email, password), types.SimpleNamespace(
+            lock=threading.Lock(), state=None, pool=None, contexts=[]))
+
+def get_session(email: str, password: str) -> dict:
+    user = _user(email, password)
+    with user.lock:
+        if user.state is None:
+            with st.spinner('Logging in to myCIRSE…'):
+                _, browser = get_browser()   # resolved here: cached resources need the script thread
+                user.state = _run(_login(browser, email, password))
+        return user.state
+
+async def _login(browser, email: str, password: str) -> dict:
+    state_path = _state_path(email, password)
+    stored = state_path.exists()
+    ctx = await browser.new_context(**({'storage_state': str(state_path)} if stored else {}))
+    try:
+        if not stored:
+            page = await ctx.new_page()
+            await cirse_agent.playwright_login(page, email, password)
+        state = await ctx.storage_state()
+        if not stored:
+            state_path.parent.mkdir(parents=True, exist_ok=True)
+            cirse_agent.write_private(state_path, json.dumps(state))   # live cookies: 0600 from the start
+        await cirse_agent.export_cookies(ctx, _cookie_path(email, password))
+        return state
+    finally:
+        await ctx.close()
+
+async def _close_contexts(contexts):
+    await asyncio.gather(*(ctx.close() for ctx in contexts), return_exceptions=True)
+
+def _forget_session(email: str, password: str):
+    """Drop a session CIRSE no longer accepts; the next get_session logs in again."""
+    _state_path(email, password).unlink(missing_ok=True)
+    _cookie_path(email, password).unlink(missing_ok=True)
+    store = _sessions()
+    with store.lock:
+        user = store.users.pop(_session_key(email, password), None)
+    if user and user.contexts:
+        _run(_close_contexts(user.contexts))
+
+POOL_SIZE = 4   # pooled pages, i.e. concurrent lecture downloads
+
+# Pages already carrying the session, each in its own context, reused by every
+# Process click. Workers check one out per download and hand it back.
+def get_page_pool(email: str, password: str) -> asyncio.Queue:
+    session = get_session(email, password)
+    user = _user(email, password)
+    with user.lock:
+        if user.pool is None:
+            with st.spinner('Warming up browser pages…'):
+                _, browser = get_browser()
+                user.pool = _run(_warm_pool(browser, session, user.contexts))
+        return user.pool
+
+async def _warm_pool(browser, session: dict, contexts: list) -> asyncio.Queue:
+    pool = asyncio.Queue()
+    for _ in range(POOL_SIZE):
+        ctx = await cirse_agent.lean_context(browser, storage_state=session)
+        contexts.append(ctx)   # closed by _forget_session, checked out or not
+        pool.put_nowait(await ctx.new_page())
+    return pool
+
+# Identical searches within the TTL are served from Streamlit's data cache,
+# across sessions. Underscore args are left out of the cache key, so neither
+# the password nor the raw email is stored in it; the session key stands in
+# for both, so a wrong password is never served another login's results.
+@st.cache_data(ttl=900, show_spinner='Searching CIRSE…')
+def cached_search(session_key: str, query: str, top_n: int, _email: str, _password: str) -> list[dict]:
+    _, browser = get_browser()
+
+    async def do_search(session):
+        ctx = await cirse_agent.lean_context(browser, storage_state=session)
+        try:
+            page = await ctx.new_page()
+            return await cirse_agent.search_videos(page, query, max_results=top_n)
+        finally:
+            await ctx.close()
+
+    try:
+        hits = _run(do_search(get_session(_email, _password)))
+    except cirse_agent.SessionExpired:
+        _forget_session(_email, _password)
+        hits = _run(do_search(get_session(_email, _password)))
+    return [dataclasses.asdict(h) for h in hits]
 
 if st.button('Search'):
     if not all([CIRSE_EMAIL, CIRSE_PASSWORD, OPENAI_API_KEY, query]):
         st.error('Fill in every box.')
         st.stop()
 
-    os.environ.update(
-        CIRSE_EMAIL=CIRSE_EMAIL,
-        CIRSE_PASSWORD=CIRSE_PASSWORD,
-        OPENAI_API_KEY=OPENAI_API_KEY,
-    )
+    # Repeating a search already run in this session costs a dict lookup, not
+    # another browser round-trip.
+    session_key = _session_key(CIRSE_EMAIL, CIRSE_PASSWORD)
+    key = (query, top_n, session_key)
+    results_cache = st.session_state.setdefault('results_cache', {})
+    if key not in results_cache:
+        hits = cached_search(session_key, query, top_n, CIRSE_EMAIL, CIRSE_PASSWORD)
+        results_cache[key] = [cirse_agent.VideoResult(**h) for h in hits]
+    st.session_state['results_key'] = key
 
-    async def do_search():
-        async with playwright_async.async_playwright() as pw:
-            browser = await _browser(pw)
-            page = await browser.new_page()
-            await cirse_agent.playwright_login(page)
-            hits = await cirse_agent.search_videos(page, query, max_results=top_n)
-            await browser.close()
-            return hits
-
-    results: List[cirse_agent.VideoResult] = asyncio.run(do_search())
+# Results live in session_state: every edit of the table below is a rerun in
+# which the Search button reads False.
+results: List[cirse_agent.VideoResult] | None = (
+    st.session_state['results_cache'][st.session_state['results_key']]
+    if 'results_key' in st.session_state else None)
+if results is not None:
     if not results:
         st.warning('No results')
         st.stop()
 
     st.subheader('Results')
-    picks = []
-    for i, r in enumerate(results):
-        if st.checkbox(f"{r.title} ({r.year or 'n/a'}) – {r.speaker or 'Unknown'}", key=i):
-            picks.append(i)
+    df = pd.DataFrame([{'select': False, 'title': r.title, 'year': r.year, 'speaker': r.speaker} for r in results])
+    # Keyed per search: picks survive reruns of the same search, and a new
+    # search starts with nothing ticked.
+    edited = st.data_editor(
+        df, hide_index=True, disabled=['title', 'year', 'speaker'],
+        column_config={'select': st.column_config.CheckboxColumn('Pick')},
+        key=f"results_editor_{hashlib.sha256(repr(st.session_state['results_key']).encode()).hexdigest()[:12]}",
+    )
+    picks = edited.index[edited['select']].tolist()
 
     if picks and st.button('Process selected'):
-        progress = st.progress(0.0)
-        out_dir = Path('cirse_notes'); out_dir.mkdir(exist_ok=True)
+        if 'run' in st.session_state:   # picked up again below; starting another would pay twice
+            st.warning('The previous selection is still processing; wait for it to finish.')
+        elif not all([CIRSE_EMAIL, CIRSE_PASSWORD, OPENAI_API_KEY]):   # cleared since the search
+            st.error('Fill in every credential.')
+            st.stop()
+        else:
+            videos = [results[i] for i in picks]
+            page_pool = get_page_pool(CIRSE_EMAIL, CIRSE_PASSWORD)
+            run = types.SimpleNamespace(videos=videos, email=CIRSE_EMAIL, password=CIRSE_PASSWORD,
+                                        finished=[])   # appended from the loop thread
+            run.fut = _submit(cirse_agent.process_videos(videos, WORKDIR, on_done=run.finished.append,
+                                                         batch=batch_mode, downloaders=POOL_SIZE, page_pool=page_pool,
+                                                         cookiefile=_cookie_path(CIRSE_EMAIL, CIRSE_PASSWORD),
+                                                         api_key=OPENAI_API_KEY))
+            st.session_state['run'] = run
 
-        async def do_process():
-            total = len(picks)
-            async with playwright_async.async_playwright() as pw:
-                for n, idx in enumerate(picks, 1):
-                    progress.progress((n-1)/total, f'Processing {results[idx].title[:60]}…')
-                    await cirse_agent.process_video(pw, 'https://library.cirse.org', results[idx], out_dir)
-                progress.progress(1.0, 'Done!')
+# The run lives in session_state: ticking a box mid-run reruns the script and
+# abandons the loop below, and the next rerun attaches to the same run again.
+if (run := st.session_state.get('run')) is not None:
+    # Progress is drawn from the script thread; Streamlit elements can't be
+    # touched from the browser loop's thread. Poll at ≤5 Hz and only redraw
+    # on change, however many lectures finish in between.
+    progress = st.progress(0.0, f'Processing {len(run.videos)} lectures…')
+    shown = 0
+    while not run.fut.done():
+        concurrent.futures.wait([run.fut], timeout=0.2)
+        if (done := len(run.finished)) != shown:
+            shown = done
+            progress.progress(done/len(run.videos), f'{done}/{len(run.videos)} done – {run.finished[done-1].title[:60]}')
+    del st.session_state['run']
+    try:
+        written = run.fut.result()
+    except cirse_agent.SessionExpired:
+        _forget_session(run.email, run.password)
+        st.error('Your CIRSE session expired. Press **Process selected** again to log in afresh.')
+        st.stop()
+    except cirse_agent.BatchIncomplete as e:
+        st.warning(f'{e}. The other notes are in the zip below; press **Process selected** again to retry the rest.')
+        written = e.outputs
+    else:
+        progress.progress(1.0, 'Done!')
 
-        asyncio.run(do_process())
+    st.session_state['last_outputs'] = [p for pair in written for p in pair]
 
-        for md in out_dir.glob('*.md'):
-            st.download_button(f'Download {md.name}', md.read_bytes(), file_name=md.name, mime='text/markdown')
+# One zip instead of a button (and a disk read) per file; rebuilt only when the
+# outputs of the last run change. Kept outside the Process branch so it
+# survives the rerun that clicking it causes.
+if outputs := st.session_state.get('last_outputs'):
+    zip_key = tuple((p.name, p.stat().st_mtime_ns) for p in outputs)
+    if st.session_state.get('zip_key') != zip_key:
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, 'w', zipfile.ZIP_DEFLATED) as z:
+            for p in outputs:
+                z.write(p, p.name)
+        st.session_state.update(zip_key=zip_key, zip_bytes=buf.getvalue())
+    st.download_button('Download all notes (zip)', st.session_state['zip_bytes'],
+                       file_name='cirse_notes.zip', mime='application/zip')